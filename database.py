@@ -5,29 +5,68 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, WriteConcern
+from pymongo.errors import OperationFailure
 from datetime import datetime, timezone
+import asyncio
+import logging
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import Any, Dict, List, Optional, Set, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 _client = None
 db = None
 
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
-if database_url and database_name:
-    _client = MongoClient(database_url)
-    db = _client[database_name]
+# Primary ack without journal/replica wait, for writes the UI can afford to lose
+RELAXED_WRITE_CONCERN = WriteConcern(w=1, j=False)
+
+
+def connect():
+    """Create the Motor client; call from the app lifespan so it binds to the running loop"""
+    global _client, db
+    if database_url and database_name:
+        _client = AsyncIOMotorClient(database_url, tz_aware=True)
+        db = _client[database_name]
+
+
+def close():
+    """Close the Motor client created by connect()"""
+    global _client, db
+    if _client is not None:
+        _client.close()
+    _client = None
+    db = None
+
+
+def _as_stored(value: Any) -> Any:
+    """Datetimes as a tz-aware re-read returns them: UTC, millisecond precision (naive = UTC)"""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        value = value.astimezone(timezone.utc)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return value
+
 
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
-    """Insert a single document with timestamp"""
+async def insert_document(
+    collection_name: str, data: Union[BaseModel, dict], write_concern: Optional[WriteConcern] = None
+) -> dict:
+    """Insert a single document with timestamp and return it (including _id).
+
+    None fields are not stored, but the returned document keeps them; read
+    paths restore them as null, so API responses always have the full shape.
+    """
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
 
@@ -37,19 +76,142 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     else:
         data_dict = data.copy()
 
-    data_dict['created_at'] = datetime.now(timezone.utc)
-    data_dict['updated_at'] = datetime.now(timezone.utc)
+    # BSON dates are UTC with millisecond precision; echo what a re-read would return
+    data_dict = {k: _as_stored(v) for k, v in data_dict.items()}
+    now = _as_stored(datetime.now(timezone.utc))
+    data_dict['created_at'] = now
+    data_dict['updated_at'] = now
 
-    result = db[collection_name].insert_one(data_dict)
-    return str(result.inserted_id)
+    stored = {k: v for k, v in data_dict.items() if v is not None}
+    collection = db.get_collection(collection_name, write_concern=write_concern)
+    result = await collection.insert_one(stored)
+    data_dict['_id'] = result.inserted_id
+    return data_dict
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
+    """Insert a single document with timestamp"""
+    doc = await insert_document(collection_name, data)
+    return str(doc['_id'])
+
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
     """Get documents from collection"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
-    
+
     cursor = db[collection_name].find(filter_dict or {})
     if limit:
         cursor = cursor.limit(limit)
-    
-    return list(cursor)
+
+    return await cursor.to_list(length=limit)
+
+
+
+class DocumentLoader:
+    """Coalesce concurrent find-by-_id lookups on one collection into a single $in query.
+
+    Calls to load() made within `wait_ms` of each other (up to `max_batch_size`
+    distinct IDs) share one round-trip. Nothing is cached between batches, so a
+    load issued after a write sees that write.
+    """
+
+    def __init__(self, collection_name: str, max_batch_size: int = 256, wait_ms: float = 1):
+        self.collection_name = collection_name
+        self.max_batch_size = max_batch_size
+        self.wait_ms = wait_ms
+        self._pending: Dict[Any, List[asyncio.Future]] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def load(self, _id: Any) -> Optional[dict]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(_id, []).append(future)
+        if len(self._pending) >= self.max_batch_size:
+            self._dispatch()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.wait_ms / 1000, self._dispatch)
+        return await future
+
+    def _dispatch(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: Dict[Any, List[asyncio.Future]]):
+        try:
+            if db is None:
+                raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+            docs = await db[self.collection_name].find({"_id": {"$in": list(batch)}}).to_list(length=None)
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        by_id = {doc["_id"]: doc for doc in docs}
+        for _id, futures in batch.items():
+            doc = by_id.get(_id)
+            for future in futures:
+                if not future.done():
+                    # each caller gets its own dict since handlers mutate the result
+                    future.set_result(dict(doc) if doc is not None else None)
+
+
+async def migrate():
+    """Idempotent data migrations run once at startup"""
+    # delivery.status: legacy RECEIVED is not a delivery status anymore
+    await db["delivery"].update_many({"status": "RECEIVED"}, {"$set": {"status": "COMPLETED"}})
+    # product.sku_lc: lower-cased sku for prefix search
+    await db["product"].update_many(
+        {"sku_lc": {"$exists": False}},
+        [{"$set": {"sku_lc": {"$toLower": "$sku"}}}],
+    )
+    # deliveryitem.delivery_id_ref: ObjectId copy of the delivery_id string
+    await db["deliveryitem"].update_many(
+        {"delivery_id_ref": {"$exists": False}},
+        [{"$set": {"delivery_id_ref": {
+            "$convert": {"input": "$delivery_id", "to": "objectId", "onError": None}
+        }}}],
+    )
+
+
+async def ensure_indexes():
+    """Create the indexes used by the API queries (no-op if they exist)"""
+    await db["delivery"].create_indexes([
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("created_at", DESCENDING)]),
+    ])
+    await db["deliveryitem"].create_indexes([
+        IndexModel([("delivery_id_ref", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("delivery_id", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("status", ASCENDING)]),
+        IndexModel([("created_at", DESCENDING)]),
+    ])
+    # an earlier text index built with the default (English) language would conflict
+    for name, spec in (await db["product"].index_information()).items():
+        if "weights" in spec and spec.get("default_language") != "german":
+            await db["product"].drop_index(name)
+    await db["product"].create_indexes([
+        # product names are German: stem and drop stop words accordingly
+        IndexModel([("name", TEXT), ("sku", TEXT)], default_language="german"),
+        IndexModel([("sku_lc", ASCENDING)]),
+        IndexModel([("created_at", DESCENDING)]),
+    ])
+    try:
+        await db["product"].create_index([("sku", ASCENDING)], unique=True)
+    except OperationFailure as e:
+        # SKU uniqueness was never enforced before, so existing data may hold duplicates.
+        # Keep a plain index for lookups until they are cleaned up.
+        logger.warning(
+            "Unique index on product.sku not created (%s). Remove duplicate SKUs and drop "
+            "the sku_1 index to enforce uniqueness.", e,
+        )
+        await db["product"].create_index([("sku", ASCENDING)])
+    await db["variant"].create_indexes([
+        IndexModel([("product_id", ASCENDING), ("created_at", DESCENDING)]),
+    ])
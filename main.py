@@ -1,13 +1,21 @@
+import logging
 import os
+import re
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-from typing import List, Optional, Dict, Any
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple, Type
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from bson import ObjectId
+import orjson
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 
-from database import db, create_document, get_documents
+import database
+from database import RELAXED_WRITE_CONCERN, DocumentLoader, insert_document
 from schemas import (
     Delivery, DeliveryItem, Product, Variant, Location,
     DeliveryStatus, DeliveryItemStatus,
@@ -15,14 +23,70 @@ from schemas import (
     ReceiveItemsRequest
 )
 
-app = FastAPI(title="Noven Pro - Lagerverwaltungssystem API")
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Motor client must be created on the running event loop
+    database.connect()
+    if database.db is not None:
+        # Indexes first so the migration filters (status, delivery_id_ref) can use them.
+        # Both are idempotent; if MongoDB is unreachable keep serving so /test can report it.
+        try:
+            await database.ensure_indexes()
+            await database.migrate()
+        except Exception:
+            logger.exception("Database setup (indexes/migrations) failed; continuing without it")
+    # batches concurrent delivery lookups by _id across requests
+    app.state.delivery_loader = DocumentLoader("delivery")
+    yield
+    database.close()
+
+
+def _json_default(obj: Any) -> str:
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError
+
+
+def json_dumps(content: Any) -> bytes:
+    return orjson.dumps(
+        content,
+        default=_json_default,
+        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC,
+    )
+
+
+class MongoJSONResponse(ORJSONResponse):
+    """orjson response that also encodes ObjectId; datetimes are handled natively"""
+
+    def render(self, content: Any) -> bytes:
+        return json_dumps(content)
+
+
+app = FastAPI(
+    title="Noven Pro - Lagerverwaltungssystem API",
+    lifespan=lifespan,
+    default_response_class=MongoJSONResponse,
+)
+
+# Explicit origins (comma-separated CORS_ORIGINS); credentials cannot be combined with "*"
+ALLOWED_ORIGINS = [origin.strip() for origin in os.getenv("CORS_ORIGINS", "").split(",") if origin.strip()]
+if not ALLOWED_ORIGINS:
+    logger.warning(
+        "CORS_ORIGINS is not set: browser requests from other origins (e.g. the frontend) will be "
+        "rejected. Set it to a comma-separated list such as https://app.example.com."
+    )
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "authorization"],
+    # let browsers cache preflight responses for a day
+    max_age=86400,
 )
 
 
@@ -30,31 +94,163 @@ app.add_middleware(
 class IdModel(BaseModel):
     id: str
 
+_HEX24 = re.compile(r"[0-9a-fA-F]{24}")
+
+
 def oid(id_str: str) -> ObjectId:
-    try:
-        return ObjectId(id_str)
-    except Exception:
+    # a 24-char hex string is exactly what ObjectId accepts; reject others without try/except
+    if not _HEX24.fullmatch(id_str):
         raise HTTPException(status_code=400, detail="Invalid ID")
+    return ObjectId(id_str)
+
+
+# Path dependencies: parse the ID once per request
+def delivery_object_id(delivery_id: str) -> ObjectId:
+    return oid(delivery_id)
+
+
+def item_object_id(item_id: str) -> ObjectId:
+    return oid(item_id)
+
+
+# Fields returned by the list endpoints; heavier fields only via ?include=
+DELIVERY_LIST_PROJECTION = {
+    "supplier": 1, "reference": 1, "status": 1, "expectedDate": 1, "receivedQty": 1, "created_at": 1,
+}
+DELIVERY_OPTIONAL_FIELDS = ("meta",)
+DELIVERYITEM_LIST_PROJECTION = {
+    "delivery_id": 1, "product_id": 1, "variant_id": 1, "expectedQty": 1, "receivedQty": 1,
+    "status": 1, "location": 1, "created_at": 1,
+}
+DELIVERYITEM_OPTIONAL_FIELDS = ("notes",)
+PRODUCT_LIST_PROJECTION = {"sku": 1, "name": 1, "description": 1, "created_at": 1}
+VARIANT_LIST_PROJECTION = {"product_id": 1, "sku": 1, "attributes": 1, "created_at": 1}
+
+
+def nullable_fields(model: Type[BaseModel]) -> Tuple[str, ...]:
+    """Model fields that default to None; these are not stored when None"""
+    return tuple(
+        name for name, field in model.model_fields.items()
+        if not field.is_required() and field.default is None
+    )
+
+
+# Responses always carry these keys, as null when the stored document lacks them
+DELIVERY_NULLABLE_FIELDS = nullable_fields(Delivery)
+DELIVERYITEM_NULLABLE_FIELDS = nullable_fields(DeliveryItem)
+PRODUCT_NULLABLE_FIELDS = nullable_fields(Product)
+VARIANT_NULLABLE_FIELDS = nullable_fields(Variant)
+
+
+def list_projection(
+    base: Dict[str, int],
+    optional: Tuple[str, ...] = (),
+    include: Optional[str] = None,
+    fields: Optional[str] = None,
+) -> Dict[str, int]:
+    """Projection for a list endpoint: base fields, plus ?include=, narrowed by ?fields="""
+    projection = dict(base)
+    if include:
+        for name in include.split(","):
+            if name.strip() in optional:
+                projection[name.strip()] = 1
+    if fields:
+        wanted = {name.strip() for name in fields.split(",")}
+        projection = {k: v for k, v in projection.items() if k in wanted}
+    # an empty projection would return whole documents
+    return projection or {"_id": 1}
+
+
+def list_pipeline(
+    filt: Dict[str, Any],
+    projection: Dict[str, Any],
+    sort: Dict[str, Any],
+    limit: int,
+    nullable: Tuple[str, ...] = (),
+) -> List[Dict[str, Any]]:
+    """List query as an aggregation that emits `id` as a string server-side.
+
+    Projected `nullable` fields missing from a document come back as null.
+    """
+    project = {
+        k: {"$ifNull": [f"${k}", None]} if k in nullable and v == 1 else v
+        for k, v in projection.items()
+    }
+    return [
+        {"$match": filt},
+        {"$sort": sort},
+        {"$limit": limit},
+        {"$project": {**project, "id": {"$toString": "$_id"}, "_id": 0}},
+    ]
+
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def prefers_ndjson(accept: str) -> bool:
+    """True if the Accept header ranks NDJSON above 0 and at least as high as JSON"""
+    weights: Dict[str, float] = {}
+    for part in accept.split(","):
+        media_type, *params = part.split(";")
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        media_type = media_type.strip().lower()
+        weights[media_type] = max(q, weights.get(media_type, 0.0))
+    ndjson_q = weights.get(NDJSON_MEDIA_TYPE, 0.0)
+    return ndjson_q > 0 and ndjson_q >= weights.get("application/json", 0.0)
+
 
+async def _ndjson_lines(cursor) -> AsyncIterator[bytes]:
+    async for doc in cursor:
+        yield json_dumps(doc) + b"\n"
 
-def serialize(doc: Dict[str, Any]) -> Dict[str, Any]:
+
+async def list_result(request: Request, collection: str, pipeline: List[Dict[str, Any]], limit: int) -> Response:
+    """Run a list pipeline; stream NDJSON if the client accepts it, else a JSON array"""
+    if prefers_ndjson(request.headers.get("accept", "")):
+        # default batching, so documents are sent while later batches are still fetched
+        cursor = database.db[collection].aggregate(pipeline)
+        return StreamingResponse(_ndjson_lines(cursor), media_type=NDJSON_MEDIA_TYPE)
+    # buffered anyway: batchSize=limit fetches the whole (limited) result in the first reply
+    cursor = database.db[collection].aggregate(pipeline, batchSize=limit)
+    return MongoJSONResponse(await cursor.to_list(length=limit))
+
+
+# Stored for indexing only, never part of an API response
+INTERNAL_FIELDS = ("delivery_id_ref", "sku_lc")
+
+
+def serialize(doc: Dict[str, Any], nullable: Tuple[str, ...] = ()) -> Dict[str, Any]:
     if not doc:
         return doc
     doc["id"] = str(doc.pop("_id"))
-    # convert datetime to iso
+    for k in INTERNAL_FIELDS:
+        doc.pop(k, None)
+    # None fields are not stored; restore them so every endpoint returns the same keys
+    for k in nullable:
+        doc.setdefault(k, None)
+    # convert datetime to iso, references to str
     for k, v in list(doc.items()):
         if isinstance(v, datetime):
             doc[k] = v.isoformat()
+        elif isinstance(v, ObjectId):
+            doc[k] = str(v)
     return doc
 
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Noven Pro Backend läuft"}
 
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -64,13 +260,13 @@ def test_database():
         "collections": []
     }
     try:
-        if db is not None:
+        if database.db is not None:
             response["database"] = "✅ Available"
             response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-            response["database_name"] = db.name
+            response["database_name"] = database.db.name
             response["connection_status"] = "Connected"
             try:
-                response["collections"] = db.list_collection_names()
+                response["collections"] = await database.db.list_collection_names()
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
                 response["database"] = f"⚠️ Connected but Error: {str(e)[:80]}"
@@ -83,7 +279,7 @@ def test_database():
 
 # -------------------- Deliveries --------------------
 @app.post("/deliveries")
-def create_delivery(payload: DeliveryCreateRequest):
+async def create_delivery(payload: DeliveryCreateRequest):
     # Business rule fixes: receivedQty = 0 at creation; status defaults to PENDING
     delivery = Delivery(
         supplier=payload.supplier,
@@ -93,48 +289,103 @@ def create_delivery(payload: DeliveryCreateRequest):
         receivedQty=0,
         meta=payload.meta or {}
     )
-    new_id = create_document("delivery", delivery)
-    doc = db["delivery"].find_one({"_id": ObjectId(new_id)})
-    return serialize(doc)
+    doc = await insert_document("delivery", delivery)
+    return serialize(doc, DELIVERY_NULLABLE_FIELDS)
 
 
 @app.get("/deliveries")
-def list_deliveries(
+async def list_deliveries(
+    request: Request,
     status_in: Optional[List[DeliveryStatus]] = Query(default=None, alias="status.in"),
-    limit: int = Query(default=100, ge=1, le=500)
+    limit: int = Query(default=100, ge=1, le=500),
+    include: Optional[str] = None,
+    fields: Optional[str] = None,
 ):
-    filt: Dict[str, Any] = {}
-    if status_in:
-        filt["status"] = {"$in": list(status_in)}
-    # Ensure no legacy RECEIVED status appears (Problem 4); defensive filter
-    filt["status"] = filt.get("status", {"$exists": True})
-    if isinstance(filt["status"], dict):
-        filt["status"]["$nin"] = list(set(filt["status"].get("$nin", [])) | {"RECEIVED"})
-    docs = db["delivery"].find(filt).limit(limit).sort("created_at", -1)
-    return [serialize(d) for d in docs]
+    # Legacy RECEIVED deliveries are migrated at startup (Problem 4), so no exclusion filter
+    filt: Dict[str, Any] = {"status": {"$in": status_in}} if status_in else {}
+    projection = list_projection(DELIVERY_LIST_PROJECTION, DELIVERY_OPTIONAL_FIELDS, include, fields)
+    pipeline = list_pipeline(filt, projection, {"created_at": -1}, limit, DELIVERY_NULLABLE_FIELDS)
+    return await list_result(request, "delivery", pipeline, limit)
 
 
 @app.get("/deliveries/{delivery_id}")
-def get_delivery(delivery_id: str):
-    doc = db["delivery"].find_one({"_id": oid(delivery_id)})
-    if not doc:
+async def get_delivery(delivery_oid: ObjectId = Depends(delivery_object_id)):
+    # Delivery and its items in a single round-trip. Filter/limit stay ahead of
+    # $lookup so only the matched parent is joined.
+    # String ids are emitted server-side and the result is encoded straight
+    # with orjson, bypassing serialize() and FastAPI's jsonable_encoder.
+    pipeline = [
+        {"$match": {"_id": delivery_oid}},
+        {"$limit": 1},
+        {"$lookup": {
+            "from": "deliveryitem",
+            "localField": "_id",
+            "foreignField": "delivery_id_ref",
+            "as": "items",
+        }},
+        {"$set": {
+            "id": {"$toString": "$_id"},
+            **{k: {"$ifNull": [f"${k}", None]} for k in DELIVERY_NULLABLE_FIELDS},
+            "items": {"$map": {
+                "input": "$items",
+                "as": "item",
+                "in": {"$mergeObjects": [
+                    {k: None for k in DELIVERYITEM_NULLABLE_FIELDS},
+                    "$$item",
+                    {"id": {"$toString": "$$item._id"}},
+                ]},
+            }},
+        }},
+        {"$unset": ["_id", "items._id", "items.delivery_id_ref"]},
+    ]
+    docs = await database.db["delivery"].aggregate(pipeline).to_list(length=1)
+    if not docs:
+        raise HTTPException(404, "Delivery not found")
+    doc = docs[0]
+    items = doc.pop("items")
+    return MongoJSONResponse({"delivery": doc, "items": items})
+
+
+@app.get("/deliveries/{delivery_id}/summary")
+async def get_delivery_summary(delivery_oid: ObjectId = Depends(delivery_object_id)):
+    if not await app.state.delivery_loader.load(delivery_oid):
         raise HTTPException(404, "Delivery not found")
-    # include items
-    items = list(db["deliveryitem"].find({"delivery_id": delivery_id}))
-    return {"delivery": serialize(doc), "items": [serialize(i) for i in items]}
+    # Item counts per status and quantity totals from one $facet pass over the items
+    pipeline = [
+        {"$match": {"delivery_id_ref": delivery_oid}},
+        {"$facet": {
+            "byStatus": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}],
+            "totals": [{"$group": {
+                "_id": None,
+                "items": {"$sum": 1},
+                "expectedQty": {"$sum": "$expectedQty"},
+                "receivedQty": {"$sum": "$receivedQty"},
+            }}],
+        }},
+    ]
+    # $facet always yields exactly one document, even with no items
+    summary = (await database.db["deliveryitem"].aggregate(pipeline).to_list(length=1))[0]
+    totals = summary["totals"][0] if summary["totals"] else {}
+    return {
+        "delivery_id": str(delivery_oid),
+        "items": totals.get("items", 0),
+        "expectedQty": totals.get("expectedQty", 0),
+        "receivedQty": totals.get("receivedQty", 0),
+        "byStatus": {row["_id"]: row["count"] for row in summary["byStatus"]},
+    }
 
 
 @app.post("/deliveries/{delivery_id}/items")
-def add_delivery_item(delivery_id: str, payload: DeliveryItemCreateRequest):
+async def add_delivery_item(payload: DeliveryItemCreateRequest, delivery_oid: ObjectId = Depends(delivery_object_id)):
     # No auto status change from PENDING -> RECEIVED (Problem 2): we strictly keep delivery.status
     # receivedQty is always 0 on creation (Problem 1)
     # If product/variant are both None, allow as free item with notes
     # Validate delivery exists
-    if not db["delivery"].find_one({"_id": oid(delivery_id)}):
+    if not await app.state.delivery_loader.load(delivery_oid):
         raise HTTPException(404, "Delivery not found")
 
     item = DeliveryItem(
-        delivery_id=delivery_id,
+        delivery_id=str(delivery_oid),
         product_id=payload.product_id,
         variant_id=payload.variant_id,
         expectedQty=payload.expectedQty,
@@ -143,9 +394,11 @@ def add_delivery_item(delivery_id: str, payload: DeliveryItemCreateRequest):
         notes=payload.notes,
         location=None,
     )
-    new_id = create_document("deliveryitem", item)
-    created = db["deliveryitem"].find_one({"_id": ObjectId(new_id)})
-    return serialize(created)
+    # ObjectId copy of delivery_id so get_delivery can $lookup on an index
+    data = item.model_dump()
+    data["delivery_id_ref"] = delivery_oid
+    created = await insert_document("deliveryitem", data, RELAXED_WRITE_CONCERN)
+    return serialize(created, DELIVERYITEM_NULLABLE_FIELDS)
 
 
 class ReceiveItemInput(BaseModel):
@@ -157,85 +410,96 @@ class ReceivePayload(BaseModel):
 
 
 @app.post("/deliveries/{delivery_id}/receive")
-def receive_items(delivery_id: str, payload: ReceivePayload):
+async def receive_items(payload: ReceivePayload, delivery_oid: ObjectId = Depends(delivery_object_id)):
     # Receive quantities for items; do NOT auto change delivery.status (Problem 2)
     # Update item.receivedQty += qty, set item.status = RECEIVED when any qty received
-    if not db["delivery"].find_one({"_id": oid(delivery_id)}):
+    if not await app.state.delivery_loader.load(delivery_oid):
         raise HTTPException(404, "Delivery not found")
 
-    total_added = 0
-    for it in payload.items:
-        item = db["deliveryitem"].find_one({"_id": oid(it.itemId), "delivery_id": delivery_id})
-        if not item:
-            raise HTTPException(400, f"Item {it.itemId} not found for this delivery")
-        if it.qty < 0:
-            raise HTTPException(400, "qty must be >= 0")
-        new_received = int(item.get("receivedQty", 0)) + int(it.qty)
-        status = item.get("status", "PENDING")
-        if it.qty > 0:
-            status = "RECEIVED"
-        db["deliveryitem"].update_one(
-            {"_id": item["_id"]},
-            {"$set": {"receivedQty": new_received, "status": status, "updated_at": datetime.now(timezone.utc)}}
+    if any(it.qty < 0 for it in payload.items):
+        raise HTTPException(400, "qty must be >= 0")
+    item_ids = {it.itemId: oid(it.itemId) for it in payload.items}
+    found = await database.db["deliveryitem"].find(
+        {"_id": {"$in": list(item_ids.values())}, "delivery_id_ref": delivery_oid}, {"_id": 1}
+    ).to_list(length=None)
+    found_ids = {d["_id"] for d in found}
+    for item_id, item_oid in item_ids.items():
+        if item_oid not in found_ids:
+            raise HTTPException(400, f"Item {item_id} not found for this delivery")
+
+    # All item updates in one round-trip; pipeline updates add to the stored qty server-side
+    now = datetime.now(timezone.utc)
+    ops = [
+        UpdateOne(
+            {"_id": item_ids[it.itemId], "delivery_id_ref": delivery_oid},
+            [{"$set": {
+                "receivedQty": {"$add": [{"$ifNull": ["$receivedQty", 0]}, it.qty]},
+                "status": "RECEIVED" if it.qty > 0 else {"$ifNull": ["$status", "PENDING"]},
+                "updated_at": now,
+            }}],
         )
-        total_added += int(it.qty)
-
-    # Update delivery.receivedQty sum of all items' receivedQty
-    agg = db["deliveryitem"].aggregate([
-        {"$match": {"delivery_id": delivery_id}},
-        {"$group": {"_id": None, "sum": {"$sum": "$receivedQty"}}}
-    ])
-    new_total = 0
-    for r in agg:
-        new_total = r.get("sum", 0)
-    db["delivery"].update_one(
-        {"_id": oid(delivery_id)},
-        {"$set": {"receivedQty": int(new_total), "updated_at": datetime.now(timezone.utc)}}
-    )
+        for it in payload.items
+    ]
+    total_added = sum(it.qty for it in payload.items)
+    if ops:
+        await database.db["deliveryitem"].bulk_write(ops, ordered=False)
+
+    # Update delivery.receivedQty sum of all items' receivedQty, written back via $merge
+    if total_added:
+        await database.db["deliveryitem"].aggregate([
+            {"$match": {"delivery_id_ref": delivery_oid}},
+            {"$group": {"_id": "$delivery_id_ref", "receivedQty": {"$sum": "$receivedQty"}}},
+            {"$set": {"updated_at": now}},
+            {"$merge": {"into": "delivery", "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}},
+        ]).to_list(length=None)
 
-    delivery = db["delivery"].find_one({"_id": oid(delivery_id)})
-    return serialize(delivery)
+    delivery = await app.state.delivery_loader.load(delivery_oid)
+    return serialize(delivery, DELIVERY_NULLABLE_FIELDS)
 
 
 @app.post("/deliveries/{delivery_id}/send-to-quality")
-def send_to_quality(delivery_id: str):
+async def send_to_quality(delivery_oid: ObjectId = Depends(delivery_object_id)):
     # Set status directly to IN_QUALITY_CHECK (Problem 3)
-    updated = db["delivery"].update_one(
-        {"_id": oid(delivery_id)},
-        {"$set": {"status": "IN_QUALITY_CHECK", "updated_at": datetime.now(timezone.utc)}}
+    doc = await database.db["delivery"].find_one_and_update(
+        {"_id": delivery_oid},
+        {"$set": {"status": "IN_QUALITY_CHECK", "updated_at": datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER,
     )
-    if updated.matched_count == 0:
+    if doc is None:
         raise HTTPException(404, "Delivery not found")
-    doc = db["delivery"].find_one({"_id": oid(delivery_id)})
-    return serialize(doc)
+    return serialize(doc, DELIVERY_NULLABLE_FIELDS)
 
 
 @app.post("/deliveries/{delivery_id}/complete")
-def complete_delivery(delivery_id: str):
-    updated = db["delivery"].update_one(
-        {"_id": oid(delivery_id)},
-        {"$set": {"status": "COMPLETED", "updated_at": datetime.now(timezone.utc)}}
+async def complete_delivery(delivery_oid: ObjectId = Depends(delivery_object_id)):
+    doc = await database.db["delivery"].find_one_and_update(
+        {"_id": delivery_oid},
+        {"$set": {"status": "COMPLETED", "updated_at": datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER,
     )
-    if updated.matched_count == 0:
+    if doc is None:
         raise HTTPException(404, "Delivery not found")
-    doc = db["delivery"].find_one({"_id": oid(delivery_id)})
-    return serialize(doc)
+    return serialize(doc, DELIVERY_NULLABLE_FIELDS)
 
 
 # -------------------- Delivery Items --------------------
 @app.get("/delivery-items")
-def list_delivery_items(
+async def list_delivery_items(
+    request: Request,
     delivery_id: Optional[str] = None,
     status_in: Optional[List[DeliveryItemStatus]] = Query(default=None, alias="status.in"),
-    limit: int = Query(default=200, ge=1, le=1000)
+    limit: int = Query(default=200, ge=1, le=1000),
+    include: Optional[str] = None,
+    fields: Optional[str] = None,
 ):
     filt: Dict[str, Any] = {}
     if delivery_id:
         filt["delivery_id"] = delivery_id
     if status_in:
-        filt["status"] = {"$in": list(status_in)}
-    docs = db["deliveryitem"].find(filt).limit(limit).sort("created_at", -1)
-    return [serialize(d) for d in docs]
+        filt["status"] = {"$in": status_in}
+    projection = list_projection(DELIVERYITEM_LIST_PROJECTION, DELIVERYITEM_OPTIONAL_FIELDS, include, fields)
+    pipeline = list_pipeline(filt, projection, {"created_at": -1}, limit, DELIVERYITEM_NULLABLE_FIELDS)
+    return await list_result(request, "deliveryitem", pipeline, limit)
 
 
 class ApprovePayload(BaseModel):
@@ -243,15 +507,15 @@ class ApprovePayload(BaseModel):
 
 
 @app.post("/delivery-items/{item_id}/approve")
-def approve_item(item_id: str, payload: ApprovePayload):
-    updated = db["deliveryitem"].update_one(
-        {"_id": oid(item_id)},
-        {"$set": {"status": "APPROVED", "notes": payload.notes, "updated_at": datetime.now(timezone.utc)}}
+async def approve_item(payload: ApprovePayload, item_oid: ObjectId = Depends(item_object_id)):
+    doc = await database.db["deliveryitem"].find_one_and_update(
+        {"_id": item_oid},
+        {"$set": {"status": "APPROVED", "notes": payload.notes, "updated_at": datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER,
     )
-    if updated.matched_count == 0:
+    if doc is None:
         raise HTTPException(404, "Item not found")
-    doc = db["deliveryitem"].find_one({"_id": oid(item_id)})
-    return serialize(doc)
+    return serialize(doc, DELIVERYITEM_NULLABLE_FIELDS)
 
 
 class StorePayload(BaseModel):
@@ -262,63 +526,88 @@ class StorePayload(BaseModel):
 
 
 @app.post("/delivery-items/{item_id}/store")
-def store_item(item_id: str, payload: StorePayload):
+async def store_item(payload: StorePayload, item_oid: ObjectId = Depends(item_object_id)):
     location = {
         "rack": payload.rack,
         "slot": payload.slot,
         "zone": payload.zone,
         "level": payload.level,
     }
-    updated = db["deliveryitem"].update_one(
-        {"_id": oid(item_id)},
-        {"$set": {"status": "STORED", "location": location, "updated_at": datetime.now(timezone.utc)}}
+    doc = await database.db["deliveryitem"].find_one_and_update(
+        {"_id": item_oid},
+        {"$set": {"status": "STORED", "location": location, "updated_at": datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER,
     )
-    if updated.matched_count == 0:
+    if doc is None:
         raise HTTPException(404, "Item not found")
-    doc = db["deliveryitem"].find_one({"_id": oid(item_id)})
-    return serialize(doc)
+    return serialize(doc, DELIVERYITEM_NULLABLE_FIELDS)
 
 
 # -------------------- Products / Variants (basic) --------------------
 @app.post("/products")
-def create_product(product: Product):
-    new_id = create_document("product", product)
-    doc = db["product"].find_one({"_id": ObjectId(new_id)})
-    return serialize(doc)
+async def create_product(product: Product):
+    # lower-cased copy of sku for indexed, case-insensitive prefix search
+    data = product.model_dump()
+    data["sku_lc"] = product.sku.lower()
+    try:
+        doc = await insert_document("product", data, RELAXED_WRITE_CONCERN)
+    except DuplicateKeyError:
+        raise HTTPException(409, "SKU already exists")
+    return serialize(doc, PRODUCT_NULLABLE_FIELDS)
 
 
 @app.get("/products")
-def list_products(q: Optional[str] = None, limit: int = 100):
+async def list_products(
+    request: Request,
+    q: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=500),
+    fields: Optional[str] = None,
+):
     filt: Dict[str, Any] = {}
+    projection = list_projection(PRODUCT_LIST_PROJECTION, fields=fields)
+    sort: Dict[str, Any] = {"created_at": -1}
     if q:
+        # Word search via the text index, plus SKU prefix match on the lower-cased
+        # sku_lc index (a case-sensitive anchored regex gets tight index bounds)
         filt["$or"] = [
-            {"name": {"$regex": q, "$options": "i"}},
-            {"sku": {"$regex": q, "$options": "i"}},
+            {"$text": {"$search": q}},
+            {"sku_lc": {"$regex": f"^{re.escape(q.lower())}"}},
         ]
-    docs = db["product"].find(filt).limit(limit).sort("created_at", -1)
-    return [serialize(d) for d in docs]
+        # relevance is returned unless ?fields= narrows it away
+        if not fields or "score" in {name.strip() for name in fields.split(",")}:
+            projection["score"] = {"$meta": "textScore"}
+        sort = {"score": {"$meta": "textScore"}, "created_at": -1}
+    pipeline = list_pipeline(filt, projection, sort, limit, PRODUCT_NULLABLE_FIELDS)
+    return await list_result(request, "product", pipeline, limit)
 
 
 @app.post("/variants")
-def create_variant(variant: Variant):
+async def create_variant(variant: Variant):
     # Ensure referenced product exists
-    if not db["product"].find_one({"_id": oid(variant.product_id)}):
+    if not await database.db["product"].find_one({"_id": oid(variant.product_id)}):
         raise HTTPException(400, "Referenced product does not exist")
-    new_id = create_document("variant", variant)
-    doc = db["variant"].find_one({"_id": ObjectId(new_id)})
-    return serialize(doc)
+    doc = await insert_document("variant", variant, RELAXED_WRITE_CONCERN)
+    return serialize(doc, VARIANT_NULLABLE_FIELDS)
 
 
 @app.get("/variants")
-def list_variants(product_id: Optional[str] = None, limit: int = 200):
+async def list_variants(
+    request: Request,
+    product_id: Optional[str] = None,
+    limit: int = Query(default=200, ge=1, le=1000),
+    fields: Optional[str] = None,
+):
     filt: Dict[str, Any] = {}
     if product_id:
         filt["product_id"] = product_id
-    docs = db["variant"].find(filt).limit(limit).sort("created_at", -1)
-    return [serialize(d) for d in docs]
+    projection = list_projection(VARIANT_LIST_PROJECTION, fields=fields)
+    pipeline = list_pipeline(filt, projection, {"created_at": -1}, limit, VARIANT_NULLABLE_FIELDS)
+    return await list_result(request, "variant", pipeline, limit)
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Each worker runs the lifespan, so it gets its own Motor client and pool
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+    uvicorn.run("main:app", host="0.0.0.0", port=port, loop="uvloop", http="httptools", workers=workers)
@@ -0,0 +1,176 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import database
+from database import DocumentLoader, insert_document
+
+
+class FakeCursor:
+    def __init__(self, collection, ids):
+        self.collection = collection
+        self.ids = ids
+
+    async def to_list(self, length=None):
+        if self.collection.error is not None:
+            raise self.collection.error
+        return [dict(self.collection.docs[i]) for i in self.ids if i in self.collection.docs]
+
+
+class FakeInsertResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class FakeCollection:
+    """Just enough of a Motor collection for find({_id: {$in: [...]}}) and insert_one"""
+
+    def __init__(self, docs, error=None):
+        self.docs = {d["_id"]: d for d in docs}
+        self.error = error
+        self.queries = []
+        self.inserted = []
+
+    async def insert_one(self, doc):
+        self.inserted.append(dict(doc))
+        return FakeInsertResult(len(self.inserted))
+
+    def find(self, filt):
+        ids = filt["_id"]["$in"]
+        self.queries.append(ids)
+        return FakeCursor(self, ids)
+
+
+@pytest.fixture
+def deliveries(monkeypatch):
+    collection = FakeCollection([{"_id": i, "n": i} for i in range(10)])
+    monkeypatch.setattr(database, "db", {"delivery": collection})
+    return collection
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_loads_share_one_query(deliveries):
+    async def scenario():
+        loader = DocumentLoader("delivery")
+        return await asyncio.gather(*(loader.load(i) for i in (1, 2, 3)))
+
+    assert run(scenario()) == [{"_id": 1, "n": 1}, {"_id": 2, "n": 2}, {"_id": 3, "n": 3}]
+    assert deliveries.queries == [[1, 2, 3]]
+
+
+def test_missing_id_resolves_to_none(deliveries):
+    async def scenario():
+        loader = DocumentLoader("delivery")
+        return await asyncio.gather(loader.load(1), loader.load(99))
+
+    assert run(scenario()) == [{"_id": 1, "n": 1}, None]
+
+
+def test_duplicate_ids_are_queried_once_and_get_separate_dicts(deliveries):
+    async def scenario():
+        loader = DocumentLoader("delivery")
+        return await asyncio.gather(loader.load(4), loader.load(4))
+
+    first, second = run(scenario())
+    assert deliveries.queries == [[4]]
+    assert first == second == {"_id": 4, "n": 4}
+    assert first is not second
+
+
+def test_max_batch_size_flushes_early(deliveries):
+    async def scenario():
+        # a long wait means only the size limit can trigger the first flushes
+        loader = DocumentLoader("delivery", max_batch_size=2, wait_ms=50)
+        return await asyncio.gather(*(loader.load(i) for i in range(5)))
+
+    assert [d["n"] for d in run(scenario())] == [0, 1, 2, 3, 4]
+    assert deliveries.queries == [[0, 1], [2, 3], [4]]
+
+
+def test_loads_after_a_batch_start_a_new_query(deliveries):
+    async def scenario():
+        loader = DocumentLoader("delivery")
+        await loader.load(1)
+        await loader.load(1)
+
+    run(scenario())
+    assert deliveries.queries == [[1], [1]]
+
+
+def test_query_error_is_raised_in_every_caller(monkeypatch):
+    monkeypatch.setattr(database, "db", {"delivery": FakeCollection([], error=RuntimeError("boom"))})
+
+    async def scenario():
+        loader = DocumentLoader("delivery")
+        return await asyncio.gather(loader.load(1), loader.load(2), return_exceptions=True)
+
+    results = run(scenario())
+    assert [type(r) for r in results] == [RuntimeError, RuntimeError]
+
+
+def test_unavailable_database_is_raised(monkeypatch):
+    monkeypatch.setattr(database, "db", None)
+
+    async def scenario():
+        return await DocumentLoader("delivery").load(1)
+
+    with pytest.raises(Exception, match="Database not available"):
+        run(scenario())
+
+
+def test_cancelled_caller_does_not_break_the_batch(deliveries):
+    async def scenario():
+        loader = DocumentLoader("delivery", wait_ms=5)
+        cancelled = asyncio.ensure_future(loader.load(1))
+        other = asyncio.ensure_future(loader.load(2))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        result = await other
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        return result, loader
+
+    result, loader = run(scenario())
+    assert result == {"_id": 2, "n": 2}
+    assert deliveries.queries == [[1, 2]]
+    assert not loader._tasks
+
+
+class FakeDatabase(dict):
+    def get_collection(self, name, write_concern=None):
+        return self[name]
+
+
+def test_insert_document_stores_sparse_and_returns_full_shape(monkeypatch):
+    collection = FakeCollection([])
+    monkeypatch.setattr(database, "db", FakeDatabase(delivery=collection))
+
+    doc = run(insert_document("delivery", {"supplier": "ACME", "reference": None}))
+
+    stored = collection.inserted[0]
+    assert "reference" not in stored
+    assert stored["supplier"] == "ACME"
+    assert doc["reference"] is None
+    assert doc["_id"] == 1
+    assert doc["created_at"] == doc["updated_at"] == stored["created_at"]
+
+
+def test_insert_document_returns_datetimes_as_stored(monkeypatch):
+    collection = FakeCollection([])
+    monkeypatch.setattr(database, "db", FakeDatabase(delivery=collection))
+    plus_two = timezone(timedelta(hours=2))
+
+    doc = run(insert_document("delivery", {
+        "naive": datetime(2024, 5, 1, 10, 0, 0, 123456),
+        "offset": datetime(2024, 5, 1, 12, 0, 0, 999999, tzinfo=plus_two),
+    }))
+
+    assert doc["naive"] == datetime(2024, 5, 1, 10, 0, 0, 123000, tzinfo=timezone.utc)
+    assert doc["naive"].tzinfo is timezone.utc
+    assert doc["offset"] == datetime(2024, 5, 1, 10, 0, 0, 999000, tzinfo=timezone.utc)
+    assert doc["offset"].tzinfo is timezone.utc
+    assert doc["created_at"].microsecond % 1000 == 0
@@ -0,0 +1,215 @@
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import database
+import main
+from main import (
+    DELIVERY_LIST_PROJECTION, DELIVERY_NULLABLE_FIELDS, DELIVERY_OPTIONAL_FIELDS, DELIVERYITEM_NULLABLE_FIELDS,
+    list_pipeline, list_projection, oid, prefers_ndjson, serialize,
+)
+
+
+def test_oid_parses_hex_ids():
+    assert oid("6ad07c2eb8fbe46a48bef5bc") == ObjectId("6ad07c2eb8fbe46a48bef5bc")
+    assert oid("6AD07C2EB8FBE46A48BEF5BC") == ObjectId("6ad07c2eb8fbe46a48bef5bc")
+
+
+@pytest.mark.parametrize("value", [
+    "",
+    "zz",
+    "6ad07c2eb8fbe46a48bef5b",     # 23 chars
+    "6ad07c2eb8fbe46a48bef5bcd",   # 25 chars
+    "6ad07c2eb8fbe46a48bef5bg",    # non-hex
+    "6ad07c2eb8fbe46a48bef5bc\n",  # trailing newline
+])
+def test_oid_rejects_invalid_ids(value):
+    with pytest.raises(HTTPException) as exc:
+        oid(value)
+    assert exc.value.status_code == 400
+
+
+def test_list_projection_defaults_to_base_fields():
+    projection = list_projection(DELIVERY_LIST_PROJECTION, DELIVERY_OPTIONAL_FIELDS)
+    assert projection == DELIVERY_LIST_PROJECTION
+    assert projection is not DELIVERY_LIST_PROJECTION
+
+
+def test_list_projection_include_adds_only_optional_fields():
+    projection = list_projection(DELIVERY_LIST_PROJECTION, DELIVERY_OPTIONAL_FIELDS, include="meta, secret")
+    assert projection["meta"] == 1
+    assert "secret" not in projection
+
+
+def test_list_projection_fields_narrows():
+    projection = list_projection(
+        DELIVERY_LIST_PROJECTION, DELIVERY_OPTIONAL_FIELDS, include="meta", fields="status, meta,bogus"
+    )
+    assert projection == {"status": 1, "meta": 1}
+
+
+def test_list_projection_never_returns_empty():
+    # an empty projection would make MongoDB return whole documents
+    assert list_projection(DELIVERY_LIST_PROJECTION, fields="bogus") == {"_id": 1}
+
+
+def test_list_pipeline_projects_missing_nullable_fields_as_null():
+    projection = {"status": 1, "notes": 1, "score": {"$meta": "textScore"}}
+
+    project = list_pipeline({}, projection, {"created_at": -1}, 10, ("notes", "location"))[-1]["$project"]
+
+    assert project == {
+        "status": 1,
+        "notes": {"$ifNull": ["$notes", None]},
+        "score": {"$meta": "textScore"},
+        "id": {"$toString": "$_id"},
+        "_id": 0,
+    }
+
+
+def test_serialize_restores_nullable_fields():
+    item_oid, delivery_oid = ObjectId(), ObjectId()
+    doc = {"_id": item_oid, "delivery_id_ref": delivery_oid, "status": "APPROVED", "notes": "ok"}
+
+    assert serialize(doc, DELIVERYITEM_NULLABLE_FIELDS) == {
+        "id": str(item_oid),
+        "status": "APPROVED",
+        "notes": "ok",
+        "product_id": None,
+        "variant_id": None,
+        "location": None,
+    }
+
+
+@pytest.mark.parametrize("accept, expected", [
+    ("application/x-ndjson", True),
+    ("application/json, application/x-ndjson", True),
+    ("application/x-ndjson, */*", True),
+    ("Application/X-NDJSON; charset=utf-8", True),
+    ("", False),
+    ("*/*", False),
+    ("application/json", False),
+    ("application/x-ndjson;q=0", False),
+    ("application/x-ndjson;q=0.5, application/json", False),
+    ("application/x-ndjson-seq", False),
+])
+def test_prefers_ndjson(accept, expected):
+    assert prefers_ndjson(accept) is expected
+
+
+class FakeAggregateCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length=None):
+        return list(self.docs)
+
+
+class FakeCollection:
+    """Records aggregate() pipelines and returns canned results"""
+
+    def __init__(self, docs=()):
+        self.docs = list(docs)
+        self.pipelines = []
+
+    def aggregate(self, pipeline, **kwargs):
+        self.pipelines.append(pipeline)
+        return FakeAggregateCursor(self.docs)
+
+    async def find_one_and_update(self, filt, update, **kwargs):
+        return dict(self.docs[0]) if self.docs else None
+
+
+@pytest.fixture
+def client():
+    # no context manager: the lifespan would try to connect to MongoDB
+    return TestClient(main.app)
+
+
+def _project_stage(pipeline):
+    return next(stage["$project"] for stage in pipeline if "$project" in stage)
+
+
+@pytest.mark.parametrize("query, expect_score", [
+    ("q=schraube", True),
+    ("q=schraube&fields=name,score", True),
+    ("q=schraube&fields=name", False),
+    ("fields=name,score", False),
+])
+def test_list_products_score_follows_fields(monkeypatch, client, query, expect_score):
+    products = FakeCollection()
+    monkeypatch.setattr(database, "db", {"product": products})
+
+    assert client.get(f"/products?{query}").status_code == 200
+
+    assert ("score" in _project_stage(products.pipelines[0])) is expect_score
+
+
+class FakeLoader:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def load(self, _id):
+        return self.docs.get(_id)
+
+
+def use_deliveries(monkeypatch, *oids):
+    # app.state.delivery_loader is only set by the lifespan, which the tests skip
+    loader = FakeLoader({oid: {"_id": oid} for oid in oids})
+    monkeypatch.setattr(main.app.state, "delivery_loader", loader, raising=False)
+
+
+def test_delivery_summary_facets_items(monkeypatch, client):
+    delivery_oid = ObjectId()
+    items = FakeCollection([{
+        "byStatus": [{"_id": "OPEN", "count": 2}, {"_id": "STORED", "count": 1}],
+        "totals": [{"_id": None, "items": 3, "expectedQty": 12, "receivedQty": 5}],
+    }])
+    monkeypatch.setattr(database, "db", {"deliveryitem": items})
+    use_deliveries(monkeypatch, delivery_oid)
+
+    response = client.get(f"/deliveries/{delivery_oid}/summary")
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "delivery_id": str(delivery_oid),
+        "items": 3,
+        "expectedQty": 12,
+        "receivedQty": 5,
+        "byStatus": {"OPEN": 2, "STORED": 1},
+    }
+    assert items.pipelines[0][0] == {"$match": {"delivery_id_ref": delivery_oid}}
+
+
+def test_delivery_summary_without_items(monkeypatch, client):
+    delivery_oid = ObjectId()
+    monkeypatch.setattr(database, "db", {"deliveryitem": FakeCollection([{"byStatus": [], "totals": []}])})
+    use_deliveries(monkeypatch, delivery_oid)
+
+    response = client.get(f"/deliveries/{delivery_oid}/summary")
+
+    assert response.json() == {
+        "delivery_id": str(delivery_oid), "items": 0, "expectedQty": 0, "receivedQty": 0, "byStatus": {},
+    }
+
+
+def test_delivery_summary_unknown_delivery(monkeypatch, client):
+    items = FakeCollection()
+    monkeypatch.setattr(database, "db", {"deliveryitem": items})
+    use_deliveries(monkeypatch)
+
+    assert client.get(f"/deliveries/{ObjectId()}/summary").status_code == 404
+    assert items.pipelines == []
+
+
+def test_update_response_has_same_keys_as_create(monkeypatch, client):
+    # stored copy of a delivery created without reference/expectedDate
+    delivery_oid = ObjectId()
+    stored = {"_id": delivery_oid, "supplier": "ACME", "status": "COMPLETED", "receivedQty": 0, "meta": {}}
+    monkeypatch.setattr(database, "db", {"delivery": FakeCollection([stored])})
+
+    body = client.post(f"/deliveries/{delivery_oid}/complete").json()
+
+    assert body["reference"] is None and body["expectedDate"] is None
+    assert set(DELIVERY_NULLABLE_FIELDS) <= set(body)